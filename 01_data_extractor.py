@@ -1,8 +1,11 @@
 import pandas as pd
-import json
+import asyncio
+import orjson
 import os
 import re
-import time
+import httpx
+import openai
+from aiolimiter import AsyncLimiter
 from typing import List, Literal
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
@@ -26,6 +29,8 @@ URI = os.getenv("NEO4J_URI")
 USER = os.getenv("NEO4J_USER")
 PWD = os.getenv("NEO4J_PASSWORD")
 AUTH = (USER, PWD)
+# 요금제의 분당 요청 한도 (RPM) - 실제 요청은 이 값의 90%로 조절
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
 
 # --- [2. 데이터 구조 정의] ---
 class Node(BaseModel):
@@ -43,14 +48,20 @@ class GraphResponse(BaseModel):
     relationships: List[Relationship]
 
 # --- [3. 유틸리티 함수] ---
+_PUNCT_RE = re.compile(r'[^\w\s]')
+
 def normalize_id(label, name):
     if pd.isna(name): return f"{label}_unknown"
-    clean_name = re.sub(r'[^\w\s]', '', str(name)).strip().lower().replace(' ', '_')
+    clean_name = _PUNCT_RE.sub('', str(name)).strip().lower().replace(' ', '_')
     return f"{label}_{clean_name}"
 
 def merge_graphs(raw_data_list):
     combined_nodes = {}
-    combined_relationships = []
+    # (type, start, end) 키로 관계를 모으며 바로 중복 제거
+    combined_relationships = {}
+    # 배치마다 별도의 LLM 호출이 같은 임시 ID("1", "c1" 등)를 재사용하므로
+    # 관계는 같은 청크에서 정의된 노드로만 연결 (청크 간 ID 공유 시 엉뚱한 노드와 연결됨)
+    skipped_rels = 0
     
     for chunk in raw_data_list:
         if not chunk: continue
@@ -59,36 +70,130 @@ def merge_graphs(raw_data_list):
             old_id = node['id']
             new_id = normalize_id(node['label'], node['name'])
             id_map[old_id] = new_id
-            combined_nodes[new_id] = {"id": new_id, "label": node['label'], "name": node['name']}
+            if new_id not in combined_nodes:
+                combined_nodes[new_id] = {"id": new_id, "label": node['label'], "name": node['name']}
 
         for rel in chunk.get('relationships', []):
-            start_id = id_map.get(rel['start_node_id'], rel['start_node_id'])
-            end_id = id_map.get(rel['end_node_id'], rel['end_node_id'])
-            combined_relationships.append({"type": rel['type'], "start_node_id": start_id, "end_node_id": end_id})
-
-    unique_rels = []
-    seen_rels = set()
-    for r in combined_relationships:
-        rel_tuple = (r['type'], r['start_node_id'], r['end_node_id'])
-        if rel_tuple not in seen_rels:
-            seen_rels.add(rel_tuple)
-            unique_rels.append(r)
-            
-    return {"nodes": list(combined_nodes.values()), "relationships": unique_rels}
+            start_id = id_map.get(rel['start_node_id'])
+            end_id = id_map.get(rel['end_node_id'])
+            if start_id is None or end_id is None:
+                skipped_rels += 1
+                continue
+            rel_key = (rel['type'], start_id, end_id)
+            if rel_key not in combined_relationships:
+                combined_relationships[rel_key] = {"type": rel['type'], "start_node_id": start_id, "end_node_id": end_id}
+
+    if skipped_rels:
+        print(f"⚠️ 같은 배치에 정의되지 않은 노드를 가리키는 관계 {skipped_rels}개를 건너뛰었습니다.")
+
+    return {"nodes": list(combined_nodes.values()), "relationships": list(combined_relationships.values())}
+
+def build_batch_text(batch_df):
+    """배치의 각 행을 '[Row n]\ncol: val / ...' 형태의 프롬프트 텍스트로 변환 (결측값 제외)"""
+    cols = batch_df.columns.tolist()
+    # 행마다 Series를 만드는 iterrows 대신 object 배열로 한 번에 변환
+    vals = batch_df.to_numpy(dtype=object, na_value=None)
+    return "".join(
+        f"[Row {idx+1}]\n" + " / ".join(f"{col}: {val}" for col, val in zip(cols, row) if val is not None) + "\n\n"
+        for idx, row in zip(batch_df.index, vals)
+    )
+
+def detect_csv_encoding(path):
+    """파일 끝까지 utf-8-sig로 디코딩해 보고 실패하면 cp949 반환 (1MB씩 읽어 메모리는 일정)"""
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            while f.read(1 << 20):
+                pass
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp949"
+
+def open_csv_reader(path, batch_size):
+    """batch_size 행씩 읽는 CSV 리더 반환 (인코딩은 스트리밍 전에 파일 전체 기준으로 결정)"""
+    return pd.read_csv(path, encoding=detect_csv_encoding(path), chunksize=batch_size)
+
+def migrate_legacy_checkpoint(legacy_path, path, batch_size):
+    """이전 형식(checkpoint_graphs.json)의 체크포인트를 JSONL 체크포인트로 한 번만 옮김"""
+    if not os.path.exists(legacy_path) or os.path.exists(path):
+        return
+    with open(legacy_path, "rb") as f:
+        legacy = orjson.loads(f.read())
+    # 순차 처리 시절은 리스트, 동시 처리 도입 후에는 {"시작 행": 그래프} 형식
+    if isinstance(legacy, list):
+        legacy = {n * batch_size: g for n, g in enumerate(legacy)}
+    with open(path, "wb") as f:
+        for i, graph in legacy.items():
+            f.write(orjson.dumps({"batch": int(i), "graph": graph}) + b"\n")
+    print(f"🔄 이전 형식 체크포인트({legacy_path})의 {len(legacy)}개 배치를 {path}로 옮겼습니다.")
+
+def load_checkpoint(path):
+    """JSONL 체크포인트를 읽어 {배치 시작 행: 그래프} 형태로 반환 (잘린 마지막 줄은 잘라냄)"""
+    done_batches = {}
+    if not os.path.exists(path):
+        return done_batches
+    with open(path, "rb+") as f:
+        valid_end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # 중단 시점에 잘린 마지막 줄
+            valid_end += len(line)
+            try:
+                record = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+            done_batches[record["batch"]] = record["graph"]
+        # 이어쓰기(append) 시 새 기록이 잘린 줄 뒤에 붙지 않도록 마지막 개행까지만 남김
+        f.truncate(valid_end)
+    return done_batches
+
+# 일시적인 오류만 재시도 (APITimeoutError는 APIConnectionError의 하위 클래스)
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)
+
+async def extract_batch(chain, limiter, i, batch_text, max_retries=3):
+    """배치 하나를 LLM으로 추출하여 (배치 시작 행, 그래프)로 반환"""
+    for attempt in range(max_retries + 1):
+        try:
+            # 토큰 버킷으로 요청 속도를 미리 조절하여 RPM 한도 초과를 방지
+            async with limiter:
+                response = await chain.ainvoke({"input_text": batch_text})
+            return i, response.model_dump(mode="json")
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                print(f"❌ 배치 {i} 처리 중 오류: {e}")
+                return i, None
+            delay = 5 * 2 ** attempt
+            print(f"⚠️ 배치 {i} 처리 중 오류, {delay}초 후 재시도 ({attempt + 1}/{max_retries}): {e}")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            # 인증 오류, 구조화 출력 검증 실패 등은 재시도해도 같으므로 바로 포기
+            print(f"❌ 배치 {i} 처리 중 오류: {e}")
+            return i, None
 
 # --- [4. 메인 실행 로직] ---
-if __name__ == "__main__":
+async def main():
     FILE_PATH = os.getenv("DATA_FILE_PATH", "data/esg_database.csv") 
     OUTPUT_DIR = "output"
-    CHECKPOINT_FILE = os.path.join(OUTPUT_DIR, "checkpoint_graphs.json")
+    CHECKPOINT_FILE = os.path.join(OUTPUT_DIR, "checkpoint_graphs.jsonl")
+    LEGACY_CHECKPOINT_FILE = os.path.join(OUTPUT_DIR, "checkpoint_graphs.json")
     FINAL_OUTPUT_FILE = os.path.join(OUTPUT_DIR, "final_merged_graph_full.json")
     
     BATCH_SIZE = 5
+    CONCURRENCY = 16
 
     if not os.path.exists(OUTPUT_DIR): os.makedirs(OUTPUT_DIR)
+    migrate_legacy_checkpoint(LEGACY_CHECKPOINT_FILE, CHECKPOINT_FILE, BATCH_SIZE)
+
+    # 동시 요청들이 keep-alive 연결을 재사용하도록 커넥션 풀 하나를 명시적으로 공유
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=CONCURRENCY * 4, max_keepalive_connections=CONCURRENCY * 2)
+    )
 
     # api_key=OPENAI_API_KEY 로 수정 완료
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0, openai_api_key=OPENAI_API_KEY)
+    # 재시도는 extract_batch가 전담하므로 SDK 자체 재시도는 끔 (중첩 재시도 방지)
+    llm = ChatOpenAI(
+        model="gpt-4o-mini", temperature=0, openai_api_key=OPENAI_API_KEY,
+        http_async_client=http_client, max_retries=0
+    )
     structured_llm = llm.with_structured_output(GraphResponse)
 
     prompt = ChatPromptTemplate.from_messages([
@@ -103,53 +208,92 @@ if __name__ == "__main__":
         ("human", "Input CSV Data (Multiple Rows):\n{input_text}")
     ])
 
-    # 데이터 로드
+    # 데이터 로드 (전체를 메모리에 올리지 않고 BATCH_SIZE 행씩 스트리밍)
+    # 배치는 완료 순서가 뒤섞이므로 시작 행 번호를 키로 체크포인트 관리
+    # 체크포인트 파싱과 CSV 열기는 서로 독립적이므로 스레드에서 동시에 수행
     try:
-        df = pd.read_csv(FILE_PATH, encoding="utf-8-sig")
-    except Exception:
-        try:
-            df = pd.read_csv(FILE_PATH, encoding="cp949")
-        except Exception as e:
-            print(f"❌ 파일을 찾을 수 없거나 인코딩 오류: {e}")
-            df = pd.DataFrame()
+        done_batches, reader = await asyncio.gather(
+            asyncio.to_thread(load_checkpoint, CHECKPOINT_FILE),
+            asyncio.to_thread(open_csv_reader, FILE_PATH, BATCH_SIZE),
+        )
+    except Exception as e:
+        print(f"❌ 파일을 찾을 수 없거나 인코딩 오류: {e}")
+        await http_client.aclose()
+        return
 
-    if not df.empty:
-        all_raw_graphs = []
-        processed_count = 0
+    if done_batches:
+        print(f"🔄 이전 기록 발견. 완료된 {len(done_batches)}개 배치를 건너뜁니다.")
 
-        if os.path.exists(CHECKPOINT_FILE):
-            with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
-                all_raw_graphs = json.load(f)
-            processed_count = len(all_raw_graphs) * BATCH_SIZE 
-            print(f"🔄 이전 기록 발견. 약 {processed_count}행 이후부터 시작합니다.")
+    chain = prompt | structured_llm
+    limiter = AsyncLimiter(OPENAI_RPM * 0.9, 60)
+    pending = set()
 
-        total_rows = len(df)
-        chain = prompt | structured_llm
+    print(f"🚀 배치를 최대 {CONCURRENCY}개씩 동시 처리합니다...")
 
-        for i in range(processed_count, total_rows, BATCH_SIZE):
-            batch_df = df.iloc[i : i + BATCH_SIZE]
-            print(f"[{min(i+BATCH_SIZE, total_rows)}/{total_rows}] 데이터 배치 처리 중...")
+    # 끝나는 순서대로 체크포인트에 한 줄씩 추가하여 중단되어도 진행분 보존
+    read_error = None
+    try:
+        with reader, open(CHECKPOINT_FILE, "ab") as ckpt_fp:
+            def save_result(i, graph):
+                if graph is None:
+                    return
+                done_batches[i] = graph
+                print(f"[{len(done_batches)}] 배치 {i} (행 {i+1}~{i+BATCH_SIZE}) 처리 완료")
 
-            batch_text = ""
-            for idx, row in batch_df.iterrows():
-                row_text = " / ".join([f"{col}: {val}" for col, val in row.items() if pd.notna(val)])
-                batch_text += f"[Row {idx+1}]\n{row_text}\n\n"
+                ckpt_fp.write(orjson.dumps({"batch": i, "graph": graph}) + b"\n")
+                ckpt_fp.flush()
 
-            try:
-                response = chain.invoke({"input_text": batch_text})
-                all_raw_graphs.append(response.dict())
-                
-                with open(CHECKPOINT_FILE, "w", encoding="utf-8") as f:
-                    json.dump(all_raw_graphs, f, ensure_ascii=False)
-                    
-            except Exception as e:
-                print(f"❌ 배치 {i} 처리 중 오류: {e}")
-                time.sleep(5)
+            while True:
+                # 다음 청크 파싱도 스레드에서 수행하여 진행 중인 LLM 요청과 겹치도록 함
+                try:
+                    chunk = await asyncio.to_thread(next, reader, None)
+                except Exception as e:
+                    read_error = e
+                    break
+                if chunk is None:
+                    break
+                if chunk.empty:  # 헤더만 있는 CSV
+                    continue
+
+                i = int(chunk.index[0])
+                if i in done_batches:
+                    continue
 
-        print("\n🧹 병합 및 최종 저장 중...")
-        final_graph = merge_graphs(all_raw_graphs)
+                batch_text = build_batch_text(chunk)
 
-        with open(FINAL_OUTPUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(final_graph, f, ensure_ascii=False, indent=2)
+                # 동시 요청이 CONCURRENCY개로 차 있으면 하나가 끝날 때까지 다음 청크를 읽지 않음
+                if len(pending) >= CONCURRENCY:
+                    finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in finished:
+                        save_result(*task.result())
+                pending.add(asyncio.create_task(extract_batch(chain, limiter, i, batch_text)))
 
-        print(f"🎉 완료! 노드: {len(final_graph['nodes'])}, 관계: {len(final_graph['relationships'])}")
\ No newline at end of file
+            # CSV 읽기에 실패했더라도 이미 보낸 요청은 마저 받아 체크포인트에 기록
+            for next_done in asyncio.as_completed(pending):
+                save_result(*await next_done)
+            pending.clear()
+    finally:
+        # 중단(취소) 시 남은 요청을 정리하고 커넥션 풀은 항상 닫음
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await http_client.aclose()
+
+    if read_error is not None:
+        print(f"❌ CSV 읽기 중 오류: {read_error} (완료된 배치는 체크포인트에 저장되었습니다)")
+        return
+
+    if not done_batches:  # 데이터 행이 없는 CSV는 기존 결과 파일을 덮어쓰지 않음
+        return
+
+    print("\n🧹 병합 및 최종 저장 중...")
+    all_raw_graphs = [done_batches[k] for k in sorted(done_batches)]
+    final_graph = merge_graphs(all_raw_graphs)
+
+    with open(FINAL_OUTPUT_FILE, "wb") as f:
+        f.write(orjson.dumps(final_graph, option=orjson.OPT_INDENT_2))
+
+    print(f"🎉 완료! 노드: {len(final_graph['nodes'])}, 관계: {len(final_graph['relationships'])}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
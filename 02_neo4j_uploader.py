@@ -4,7 +4,8 @@ import asyncio
 import os
 import sys
 import re
-from neo4j import GraphDatabase, TRUST_ALL_CERTIFICATES
+from collections import defaultdict
+from neo4j import AsyncGraphDatabase, TRUST_ALL_CERTIFICATES
 from pydantic import validate_call
 from dotenv import load_dotenv
 
@@ -41,48 +42,134 @@ if sys.stdout.encoding != 'utf-8':
 
 # --- 2. Custom Writer 클래스 ---
 class Neo4jCreateWriter(KGWriter):
-    def __init__(self, driver, neo4j_database="neo4j"):
+    def __init__(self, driver, neo4j_database="neo4j", batch_size=1000, max_concurrency=4,
+                 apoc_threshold=1_000_000, apoc_batch_size=10000):
         self.driver = driver
         self.neo4j_database = neo4j_database
-
-    def _prepare_db(self):
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        # 노드 수가 apoc_threshold를 넘으면 APOC(apoc.periodic.iterate)로 서버 측 배치 적재
+        self.apoc_threshold = apoc_threshold
+        self.apoc_batch_size = apoc_batch_size
+
+    @staticmethod
+    async def _create_constraints(tx, labels):
+        for label in labels:
+            result = await tx.run(f"CREATE CONSTRAINT IF NOT EXISTS FOR (n:{label}) REQUIRE n.id IS UNIQUE")
+            await result.consume()
+
+    async def _prepare_db(self):
         """DB 제약 조건 생성 및 인덱싱 최적화"""
-        with self.driver.session(database=self.neo4j_database) as session:
-            # ID 중복 방지를 위한 제약 조건 설정
+        async with self.driver.session(database=self.neo4j_database) as session:
+            # ID 중복 방지를 위한 제약 조건 설정 (하나의 트랜잭션으로 일괄 커밋)
             labels = ["Company", "Report", "Rating", "Pillar", "Theme", "Content"]
-            for label in labels:
-                session.run(f"CREATE CONSTRAINT IF NOT EXISTS FOR (n:{label}) REQUIRE n.id IS UNIQUE")
+            await session.execute_write(self._create_constraints, labels)
+
+    @staticmethod
+    async def _write_rows(tx, cypher, rows):
+        result = await tx.run(cypher, rows=rows)
+        await result.consume()
+
+    async def _write_in_batches(self, jobs, concurrency):
+        """(행 r 단위 쿼리, 행 목록)들을 batch_size 행씩 UNWIND로 묶어 최대 concurrency개 트랜잭션으로 동시 실행"""
+        sem = asyncio.Semaphore(concurrency)
+
+        async def write_slice(cypher, batch):
+            async with sem:
+                # 세션은 동시 사용이 불가능하므로 슬라이스마다 풀에서 하나씩 사용
+                async with self.driver.session(database=self.neo4j_database) as session:
+                    await session.execute_write(self._write_rows, cypher, batch)
+
+        # 한 슬라이스라도 실패하면 나머지를 취소하고 모두 끝난 뒤에 예외를 올림
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for action, rows in jobs:
+                    for start in range(0, len(rows), self.batch_size):
+                        tg.create_task(write_slice(f"UNWIND $rows AS r {action}", rows[start:start + self.batch_size]))
+        except ExceptionGroup as eg:
+            raise eg.exceptions[0]
+
+    async def _write_with_apoc(self, jobs, parallel):
+        """행 목록 전체를 한 번에 넘기고 커밋 단위 분할/병렬 처리는 서버의 apoc.periodic.iterate에 위임"""
+        async with self.driver.session(database=self.neo4j_database) as session:
+            for action, rows in jobs:
+                # apoc.periodic.iterate는 자체적으로 트랜잭션을 관리하므로 auto-commit으로 실행
+                result = await session.run(
+                    "CALL apoc.periodic.iterate('UNWIND $rows AS r RETURN r', $action, "
+                    "{batchSize: $batch_size, parallel: $parallel, params: {rows: $rows}})",
+                    action=action, rows=rows, batch_size=self.apoc_batch_size, parallel=parallel
+                )
+                record = await result.single()
+                if record["failedOperations"]:
+                    raise RuntimeError(f"APOC 적재 실패 {record['failedOperations']}건: {record['errorMessages']}")
+
+    async def _write(self, jobs, use_apoc, parallel):
+        if use_apoc:
+            await self._write_with_apoc(jobs, parallel)
+        else:
+            await self._write_in_batches(jobs, self.max_concurrency if parallel else 1)
+
+    @staticmethod
+    def _node_pattern(var, label, id_key):
+        """라벨을 알면 라벨을 붙여 인덱스 조회, 그래프에 없는 노드면 라벨 없이 조회"""
+        if label:
+            return f"({var}:`{label}` {{id: r.{id_key}}})"
+        return f"({var} {{id: r.{id_key}}})"
 
     @validate_call
     async def run(self, graph: Neo4jGraph) -> KGWriterModel:
         try:
-            self._prepare_db()
-            
-            with self.driver.session(database=self.neo4j_database) as session:
-                # 1. 노드 적재 (MERGE 사용)
-                print(f"📦 {len(graph.nodes)}개 노드 적재 시작...")
-                for node in graph.nodes:
-                    cypher = f"MERGE (n:`{node.label}` {{id: $id}}) SET n += $props"
-                    session.run(cypher, {"id": node.id, "props": node.properties})
-
-                # 2. 관계 적재
-                print(f"🔗 {len(graph.relationships)}개 관계 연결 시작...")
-                for rel in graph.relationships:
-                    cypher = f"""
-                    MATCH (a {{id: $start_id}}), (b {{id: $end_id}})
-                    MERGE (a)-[r:`{rel.type}`]->(b)
-                    SET r += $props
-                    """
-                    session.run(cypher, {
-                        "start_id": rel.start_node_id,
-                        "end_id": rel.end_node_id,
-                        "props": rel.properties or {}
-                    })
+            await self._prepare_db()
+
+            use_apoc = len(graph.nodes) > self.apoc_threshold
+            if use_apoc:
+                print(f"⚡ 노드가 {self.apoc_threshold}개를 넘어 APOC 서버 측 배치 적재를 사용합니다.")
+
+            # 1. 노드 적재 (라벨별 UNWIND + MERGE)
+            print(f"📦 {len(graph.nodes)}개 노드 적재 시작...")
+            nodes_by_label = defaultdict(list)
+            for node in graph.nodes:
+                nodes_by_label[node.label].append({"id": node.id, "props": node.properties or {}})
+
+            # 노드는 ID가 모두 달라 병렬 커밋해도 충돌이 없음
+            await self._write([
+                (f"MERGE (n:`{label}` {{id: r.id}}) SET n += r.props", rows)
+                for label, rows in nodes_by_label.items()
+            ], use_apoc, parallel=True)
+
+            # 2. 관계 적재 (타입별 UNWIND + MERGE) - 노드가 모두 적재된 뒤 시작
+            print(f"🔗 {len(graph.relationships)}개 관계 연결 시작...")
+            # 양 끝 노드의 라벨까지 묶어서 MATCH가 라벨별 유니크 제약 인덱스를 타도록 함
+            label_by_id = {node.id: node.label for node in graph.nodes}
+            rels_by_key = defaultdict(list)
+            for rel in graph.relationships:
+                key = (rel.type, label_by_id.get(rel.start_node_id), label_by_id.get(rel.end_node_id))
+                rels_by_key[key].append({
+                    "start_id": rel.start_node_id,
+                    "end_id": rel.end_node_id,
+                    "props": rel.properties or {}
+                })
+
+            # 관계는 같은 노드(Pillar 등 허브)를 여러 배치가 동시에 잠글 수 있어 순차 커밋
+            await self._write([
+                (f"""
+                MATCH {self._node_pattern("a", start_label, "start_id")}, {self._node_pattern("b", end_label, "end_id")}
+                MERGE (a)-[x:`{rel_type}`]->(b)
+                SET x += r.props
+                """, rows)
+                for (rel_type, start_label, end_label), rows in rels_by_key.items()
+            ], use_apoc, parallel=False)
 
             return KGWriterModel(status="SUCCESS", metadata={"nodes": len(graph.nodes), "rels": len(graph.relationships)})
         except Exception as e:
             return KGWriterModel(status="FAILURE", metadata={"error": str(e)})
 
+async def mark_graph_updated(driver, database):
+    """앱(04)의 답변 캐시가 무효화되도록 DB에 그래프 버전(:GraphMeta) 갱신"""
+    async with driver.session(database=database) as session:
+        result = await session.run("MERGE (m:GraphMeta {id: 'graph'}) SET m.version = timestamp()")
+        await result.consume()
+
 # --- 3. 실행 메인 함수 ---
 async def main():
     # [경로 설정] output 폴더 내부의 JSON 파일 자동 탐색
@@ -119,7 +206,7 @@ async def main():
     graph_obj = Neo4jGraph(nodes=nodes, relationships=relationships)
 
     # 3. 드라이버 설정 (환경 변수 사용)
-    driver = GraphDatabase.driver(
+    driver = AsyncGraphDatabase.driver(
         URI, 
         auth=(USER, PWD), 
         encrypted=False, 
@@ -133,13 +220,14 @@ async def main():
     
     print("-" * 40)
     if result.status == "SUCCESS":
+        await mark_graph_updated(driver, DB_NAME)
         print(f"✨ 적재 성공!")
         print(f"📊 통계: 노드 {result.metadata['nodes']}개 / 관계 {result.metadata['rels']}개")
     else:
         print(f"❌ 적재 실패: {result.metadata.get('error')}")
     print("-" * 40)
     
-    driver.close()
+    await driver.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
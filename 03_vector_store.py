@@ -1,4 +1,6 @@
 import os
+import asyncio
+import httpx
 from neo4j import GraphDatabase
 from langchain_openai import OpenAIEmbeddings
 from neo4j_graphrag.indexes import create_vector_index
@@ -22,75 +24,118 @@ URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 USER = os.getenv("NEO4J_USER", "neo4j")
 PASSWORD = os.getenv("NEO4J_PASSWORD")
 
+# 한 번의 임베딩 API 호출에 묶어 보낼 텍스트 수 (OpenAI 최대 2048)
+EMBED_BATCH_SIZE = 512
+# 동시에 보낼 임베딩 요청 수
+EMBED_CONCURRENCY = 16
+
+# 동시 요청들이 keep-alive 연결을 재사용하도록 커넥션 풀 하나를 명시적으로 공유
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=EMBED_CONCURRENCY * 4, max_keepalive_connections=EMBED_CONCURRENCY * 2)
+)
+
 # OpenAI 임베딩 모델 설정
 embed_model = OpenAIEmbeddings(
     model="text-embedding-3-small", 
-    openai_api_key=OPENAI_API_KEY
+    openai_api_key=OPENAI_API_KEY,
+    http_async_client=http_client
 )
 
-def setup_vector_index():
+async def embed_chunk(sem, texts):
+    """세마포어로 동시 요청 수를 제한하며 텍스트 배치 하나를 임베딩"""
+    async with sem:
+        return await embed_model.aembed_documents(texts)
+
+def write_vectors(tx, label, rows):
+    """배치 하나의 벡터를 UNWIND 쿼리 한 번으로 'embedding' 속성에 저장하고 저장된 노드 수 반환"""
+    result = tx.run(
+        f"UNWIND $rows AS r "
+        f"MATCH (n:{label} {{id: r.id}}) "
+        f"CALL db.create.setNodeVectorProperty(n, 'embedding', r.vector) "
+        f"RETURN count(*) AS written",
+        rows=rows
+    )
+    return result.single()["written"]
+
+async def setup_vector_index():
     # 드라이버 설정 (환경 변수 사용)
     driver = GraphDatabase.driver(URI, auth=(USER, PASSWORD))
+    try:
+        # --- 1단계: 인덱스 생성 ---
+        # Company와 Content 두 곳 모두 생성 (검색 성능 향상)
+        indices = [
+            {"name": "company_name_index", "label": "Company", "prop": "name"},
+            {"name": "content_text_index", "label": "Content", "prop": "name"}
+        ]
+
+        for idx in indices:
+            print(f"✨ {idx['name']} 인덱스 생성 중...")
+            try:
+                create_vector_index(
+                    driver,
+                    index_name=idx['name'],
+                    label=idx['label'],
+                    embedding_property="embedding",
+                    dimensions=1536, # OpenAI text-embedding-3-small 모델의 차원
+                    similarity_fn="cosine",
+                )
+                print(f"✅ {idx['name']} 생성 완료!")
+            except Exception:
+                print(f"알림: {idx['name']}이 이미 존재하거나 생성을 건너뜁니다.")
+
+        # --- 2단계: 임베딩 업데이트 (배치 처리) ---
+        target_labels = ["Company", "Content"]
     
-    # --- 1단계: 인덱스 생성 ---
-    # Company와 Content 두 곳 모두 생성 (검색 성능 향상)
-    indices = [
-        {"name": "company_name_index", "label": "Company", "prop": "name"},
-        {"name": "content_text_index", "label": "Content", "prop": "name"}
-    ]
-
-    for idx in indices:
-        print(f"✨ {idx['name']} 인덱스 생성 중...")
-        try:
-            create_vector_index(
-                driver,
-                index_name=idx['name'],
-                label=idx['label'],
-                embedding_property="embedding",
-                dimensions=1536, # OpenAI text-embedding-3-small 모델의 차원
-                similarity_fn="cosine",
-            )
-            print(f"✅ {idx['name']} 생성 완료!")
-        except Exception:
-            print(f"알림: {idx['name']}이 이미 존재하거나 생성을 건너뜁니다.")
-
-    # --- 2단계: 임베딩 업데이트 (배치 처리) ---
-    target_labels = ["Company", "Content"]
-    
-    for label in target_labels:
-        print(f"🧠 {label} 노드 임베딩 업데이트 중...")
+        # 라벨마다 세션을 새로 열지 않고 하나의 세션을 끝까지 재사용
         with driver.session() as session:
-            # 임베딩이 아직 없는 노드만 추출
-            result = session.run(
-                f"MATCH (n:{label}) WHERE n.embedding IS NULL RETURN n.id as id, n.name as name"
-            )
-            
-            for record in result:
-                node_id = record["id"]
-                text_to_embed = record["name"]
-                
-                if not text_to_embed:
-                    continue
-                
-                # 텍스트를 숫자로 변환 (Embedding)
-                try:
-                    embedding_vector = embed_model.embed_query(text_to_embed)
-                    
-                    # 생성된 벡터를 DB의 'embedding' 속성에 저장
-                    session.run(
-                        f"MATCH (n:{label} {{id: $id}}) "
-                        f"CALL db.create.setNodeVectorProperty(n, 'embedding', $vector)",
-                        {"id": node_id, "vector": embedding_vector}
-                    )
-                    print(f"   - [{label}] '{text_to_embed[:10]}...' 임베딩 완료")
-                except Exception as e:
-                    print(f"❌ '{text_to_embed[:10]}' 임베딩 중 오류 발생: {e}")
-
-    print("🎉 모든 임베딩 작업이 완료되었습니다!")
-    driver.close()
+            for label in target_labels:
+                print(f"🧠 {label} 노드 임베딩 업데이트 중...")
+                # 임베딩이 아직 없는 노드만 추출
+                result = session.run(
+                    f"MATCH (n:{label}) WHERE n.embedding IS NULL RETURN n.id as id, n.name as name"
+                )
+                records = [r for r in result if r["name"]]
+
+                # 같은 이름이 여러 노드에 반복되므로 고유 텍스트만 임베딩 요청
+                unique_names = list(dict.fromkeys(r["name"] for r in records))
+                name_chunks = [unique_names[start:start + EMBED_BATCH_SIZE] for start in range(0, len(unique_names), EMBED_BATCH_SIZE)]
+
+                # 텍스트를 숫자로 변환 (Embedding) - 배치들을 동시에 요청
+                sem = asyncio.Semaphore(EMBED_CONCURRENCY)
+                results = await asyncio.gather(
+                    *(embed_chunk(sem, names) for names in name_chunks),
+                    return_exceptions=True
+                )
+
+                vec_by_name = {}
+                for names, vectors in zip(name_chunks, results):
+                    if isinstance(vectors, Exception):
+                        print(f"❌ [{label}] '{names[0][:10]}' 등 {len(names)}개 배치 임베딩 중 오류 발생: {vectors}")
+                        continue
+                    vec_by_name.update(zip(names, vectors))
+                print(f"   - [{label}] 고유 텍스트 {len(vec_by_name)}/{len(unique_names)}개 임베딩 완료 (노드 {len(records)}개)")
+
+                # 생성된 벡터를 DB의 'embedding' 속성에 저장
+                rows = [{"id": r["id"], "vector": vec_by_name[r["name"]]} for r in records if r["name"] in vec_by_name]
+                written = 0
+                for start in range(0, len(rows), EMBED_BATCH_SIZE):
+                    try:
+                        written += session.execute_write(write_vectors, label, rows[start:start + EMBED_BATCH_SIZE])
+                    except Exception as e:
+                        print(f"❌ [{label}] {start}번째부터 임베딩 저장 중 오류 발생: {e}")
+                print(f"   - [{label}] 노드 {written}/{len(rows)}개에 임베딩 저장 완료")
+
+            # 앱(04)의 답변 캐시가 무효화되도록 DB에 그래프 버전(:GraphMeta) 갱신
+            session.run("MERGE (m:GraphMeta {id: 'graph'}) SET m.version = timestamp()").consume()
+
+        print("🎉 모든 임베딩 작업이 완료되었습니다!")
+    finally:
+        # 중간에 예외가 나도 드라이버와 커넥션 풀은 항상 닫음
+        driver.close()
+        await http_client.aclose()
 
 if __name__ == "__main__":
     if not OPENAI_API_KEY:
         print("❌ 오류: OPENAI_API_KEY가 .env 파일에 설정되지 않았습니다.")
     else:
-        setup_vector_index()
\ No newline at end of file
+        asyncio.run(setup_vector_index())
\ No newline at end of file
@@ -3,6 +3,7 @@ import sys
 import io
 import streamlit as st
 import os
+import hashlib
 import openai
 from neo4j import GraphDatabase, TRUST_ALL_CERTIFICATES
 from neo4j_graphrag.retrievers import Text2CypherRetriever
@@ -33,7 +34,10 @@ if "messages" not in st.session_state:
 @st.cache_resource
 def init_rag_engine():
     """RAG 엔진 초기화: 검색 성공률을 높이기 위한 설정"""
-    driver = GraphDatabase.driver(URI, auth=AUTH, encrypted=False, trust=TRUST_ALL_CERTIFICATES)
+    # 드라이버(커넥션 풀)는 프로세스 전체에서 하나만 유지
+    driver = GraphDatabase.driver(
+        URI, auth=AUTH, encrypted=False, trust=TRUST_ALL_CERTIFICATES, max_connection_pool_size=64
+    )
     llm = OpenAILLM(model_name="gpt-4o-mini", api_key=OPENAI_API_KEY)
 
     # 예시 데이터: Theme과 Pillar의 관계를 명시
@@ -65,28 +69,75 @@ def init_rag_engine():
     openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
     return openai_client, retriever
 
-def generate_answer(client, retriever, user_question):
-    """답변 생성 및 검색 결과 확인"""
-    try:
-        result = retriever.search(query_text=str(user_question))
-        cypher_used = result.metadata.get("cypher", "")
-        items = getattr(result, 'items', [])
-
-        if not items:
-            return None, cypher_used
+def get_graph_version(retriever):
+    """캐시 키로 쓰는 그래프 버전: 02 적재/03 임베딩이 끝날 때 Neo4j의 :GraphMeta에 기록됨 (없으면 0)"""
+    with retriever.driver.session() as session:
+        record = session.run("MATCH (m:GraphMeta {id: 'graph'}) RETURN m.version AS version").single()
+    return record["version"] if record else 0
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_retrieval(user_question, graph_version):
+    """같은 질문은 Text2Cypher 검색 없이 재사용 (예외 발생 시에는 캐시되지 않음)"""
+    _, retriever = init_rag_engine()
+    result = retriever.search(query_text=str(user_question))
+    cypher_used = result.metadata.get("cypher", "")
+    items = getattr(result, 'items', [])
+
+    if not items:
+        return None, cypher_used
+
+    context = "\n".join([str(i) for i in items])
+    return context, cypher_used
+
+@st.cache_resource(ttl=3600)
+def _answer_cache():
+    """스트리밍이 끝난 답변 보관소: (질문, 그래프 버전, 검색 결과 해시) -> 답변"""
+    return {}
+
+def stream_answer(client, user_question, context, cache_key):
+    """GPT 답변을 토큰 단위로 yield (이미 완성된 답변이 있으면 그대로 반환)"""
+    cache = _answer_cache()
+    if cache_key in cache:
+        yield cache[cache_key]
+        return
 
-        context = "\n".join([str(i) for i in items])
-        response = client.chat.completions.create(
+    try:
+        stream = client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "당신은 ESG 전문가입니다. 제공된 데이터를 기반으로 한국어로 답변하세요."},
                 {"role": "user", "content": f"질문: {user_question}\n\n데이터: {context}"}
-            ]
+            ],
+            stream=True
         )
-        return response.choices[0].message.content, cypher_used
+        parts = []
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+        cache[cache_key] = "".join(parts)
 
     except Exception as e:
-        return f"❌ 분석 중 오류 발생: {str(e)}", "Error"
+        yield f"❌ 분석 중 오류 발생: {str(e)}"
+
+def generate_answer(user_question):
+    """검색 수행 후 (답변 스트림, 실행된 Cypher) 반환. 검색 결과가 없으면 답변 스트림은 None"""
+    try:
+        _, retriever = init_rag_engine()
+        graph_version = get_graph_version(retriever)
+        context, cypher_used = _cached_retrieval(user_question, graph_version)
+
+    except Exception as e:
+        return iter([f"❌ 분석 중 오류 발생: {str(e)}"]), "Error"
+
+    if context is None:
+        return None, cypher_used
+
+    client, _ = init_rag_engine()
+    # 검색 캐시가 먼저 만료되어 Text2Cypher가 다른 결과를 내면 이전 답변을 재사용하지 않도록 검색 결과까지 키에 포함
+    cache_key = (user_question, graph_version, hashlib.sha256(context.encode("utf-8")).hexdigest())
+    return stream_answer(client, user_question, context, cache_key), cypher_used
 
 # --- [3. 메인 UI 구성] ---
 st.title("🌿 ESG GraphRAG Explorer")
@@ -97,7 +148,7 @@ try:
     if not OPENAI_API_KEY:
         st.error("🔑 .env 파일에 OPENAI_API_KEY를 설정해주세요.")
         st.stop()
-    client, retriever = init_rag_engine()
+    init_rag_engine()
 except Exception as e:
     st.error(f"⚠️ 엔진 초기화 실패: {str(e)}")
     st.stop()
@@ -117,16 +168,18 @@ if prompt := st.chat_input("질문을 입력하세요"):
     # 2. 어시스턴트 답변 생성
     with st.chat_message("assistant"):
         with st.spinner("그래프 데이터를 분석 중입니다..."):
-            answer, cypher_used = generate_answer(client, retriever, prompt)
-            
-            if answer is None:
-                st.error("❌ 데이터를 찾지 못했습니다. 검색 조건을 바꿔보세요.")
-            else:
-                st.markdown(answer)
-            
-            # 실행된 쿼리 표시
-            with st.expander("🛠️ 실행된 Cypher 쿼리 확인"):
-                st.code(cypher_used, language="cypher")
-            
-            # 답변 저장
-            st.session_state.messages.append({"role": "assistant", "content": answer if answer else "검색 결과 없음"})
\ No newline at end of file
+            answer_stream, cypher_used = generate_answer(prompt)
+
+        # 답변은 생성되는 대로 바로 표시
+        if answer_stream is None:
+            answer = None
+            st.error("❌ 데이터를 찾지 못했습니다. 검색 조건을 바꿔보세요.")
+        else:
+            answer = st.write_stream(answer_stream)
+        
+        # 실행된 쿼리 표시
+        with st.expander("🛠️ 실행된 Cypher 쿼리 확인"):
+            st.code(cypher_used, language="cypher")
+        
+        # 답변 저장
+        st.session_state.messages.append({"role": "assistant", "content": answer if answer else "검색 결과 없음"})
\ No newline at end of file